@@ -1,8 +1,11 @@
-import json
-import re
-import ollama
-from jsonschema import validate, ValidationError
-import bleach
+import asyncio
+import os
+import weakref
+from types import MappingProxyType
+import fastjsonschema
+import orjson
+from ollama import AsyncClient
+import nh3
 import logging
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
@@ -11,10 +14,28 @@ from json_repair import repair_json
 # Configure logging
 logger = logging.getLogger(__name__)
 
-ALLOWED_TAGS = ["p", "br", "ul", "li", "strong", "em", "b", "i", "h1", "h2", "h3", "ol"]
+# One client per running event loop: under WSGI Django runs each async view in
+# a fresh loop, and the httpx connections inside AsyncClient must not outlive
+# the loop they were opened on. For the Ollama server to actually service
+# concurrent chats, set OLLAMA_NUM_PARALLEL (parallel requests per model) and
+# OLLAMA_MAX_LOADED_MODELS in its environment.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_client() -> AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncClient()
+    return client
+
+# nh3 expects sets; built once at import so nothing is converted per call.
+ALLOWED_TAGS = {"p", "br", "ul", "li", "strong", "em", "b", "i", "h1", "h2", "h3", "ol"}
 ALLOWED_ATTRIBUTES = {
-    "*": ["class"],
-    "a": ["href", "title"],
+    "*": {"class"},
+    "a": {"href", "title"},
 }
 
 
@@ -32,9 +53,21 @@ def sanitize_text(text: str) -> str:
     """Enhanced text sanitization with more allowed tags"""
     if not isinstance(text, str):
         return str(text)
-    return bleach.clean(
-        text, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True
-    )
+    return nh3.clean(text, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES)
+
+
+# Fields that never hold HTML; running the sanitizer on them is wasted work.
+_SKIP_SANITIZE = frozenset({"num_pupils", "date"})
+
+
+def sanitize_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Sanitize all string fields of a lesson-plan payload in one pass"""
+    return {
+        key: sanitize_text(value)
+        if isinstance(value, str) and key not in _SKIP_SANITIZE
+        else value
+        for key, value in data.items()
+    }
 
 
 SCHEMA = {
@@ -82,22 +115,41 @@ SCHEMA = {
     "additionalProperties": False,
 }
 
+# Compiled once at import; fastjsonschema generates straight-line validation
+# code instead of rebuilding a validator graph per call.
+_VALIDATE = fastjsonschema.compile(SCHEMA)
+
+
+def _strip_code_fences(content: str) -> str:
+    """Strip a surrounding ``` or ` wrapper with a direct string scan;
+    avoids regex backtracking over multi-KB responses."""
+    if content.startswith("```"):
+        end = content.rfind("```")
+        if end > 3:
+            start = 3
+            if content.startswith("json", start):
+                start += 4
+            newline = content.find("\n", start)
+            if -1 < newline < end:
+                start = newline + 1
+            return content[start:end].strip()
+    elif len(content) >= 2 and content.startswith("`") and content.endswith("`"):
+        return content[1:-1].strip()
+    return content
+
 
 def clean_invalid_json_chars(content: str) -> str:
     logger.debug(f"Raw input content: {repr(content)}")
-    content = content.replace("\ufeff", "").strip()
-    patterns = [
-        (r"```json\s*(.*?)\s*```", r"\1"),
-        (r"```\s*(.*?)\s*```", r"\1"),
-        (r"`(.*?)`", r"\1"),
-    ]
-    for pattern, replacement in patterns:
-        if re.search(pattern, content, re.DOTALL):
-            content = re.sub(pattern, replacement, content, flags=re.DOTALL).strip()
-            break
+    content = _strip_code_fences(content.replace("\ufeff", "").strip())
+    # Fast path: well-formed responses skip the character-level repair pass
+    try:
+        orjson.loads(content)
+        return content
+    except orjson.JSONDecodeError:
+        pass
     try:
         cleaned = repair_json(content)
-        json.loads(cleaned)
+        orjson.loads(cleaned)
         logger.debug(f"Cleaned content: {repr(cleaned)}")
         return cleaned.strip()
     except Exception as e:
@@ -105,7 +157,7 @@ def clean_invalid_json_chars(content: str) -> str:
         raise ValueError(f"Unable to clean JSON: {e}")
 
 
-def generate_lesson_plan(
+async def generate_lesson_plan(
     prompt: str, config: Optional[LessonPlanConfig] = None
 ) -> Dict[str, Any]:
     """Generate lesson plan with enhanced error handling, normalization, and retries"""
@@ -119,7 +171,7 @@ def generate_lesson_plan(
             logger.info(
                 f"Generating lesson plan - attempt {attempt + 1}/{config.max_retries}"
             )
-            response = ollama.chat(
+            response = await _get_client().chat(
                 model=config.model_name,
                 messages=[{"role": "user", "content": prompt}],
                 options={"temperature": config.temperature, "timeout": config.timeout},
@@ -133,20 +185,20 @@ def generate_lesson_plan(
             clean_content = clean_invalid_json_chars(content)
             logger.debug(f"Cleaned JSON: {repr(clean_content)}")
 
-            parsed = json.loads(clean_content)
+            parsed = orjson.loads(clean_content)
             normalized = normalize_ai_response(parsed)
             logger.debug(f"Normalized JSON: {repr(normalized)}")
 
-            validate(instance=normalized, schema=SCHEMA)
+            _VALIDATE(normalized)
             logger.info("Successfully generated and validated lesson plan")
             return normalized
 
-        except json.JSONDecodeError as je:
+        except orjson.JSONDecodeError as je:
             last_error = je
             logger.warning(f"JSON decode error on attempt {attempt + 1}: {je}")
             logger.debug(f"Raw content: {repr(content)}")
             logger.debug(f"Cleaned content: {repr(clean_content)}")
-        except ValidationError as ve:
+        except fastjsonschema.JsonSchemaException as ve:
             last_error = ve
             logger.warning(f"Schema validation failed on attempt {attempt + 1}: {ve}")
             logger.debug(f"Parsed JSON: {repr(parsed)}")
@@ -158,9 +210,7 @@ def generate_lesson_plan(
             logger.error(f"Unexpected error on attempt {attempt + 1}: {e}")
 
         if attempt < config.max_retries - 1:
-            import time
-
-            time.sleep(2**attempt)  # Exponential backoff
+            await asyncio.sleep(2**attempt)  # Exponential backoff
 
     error_msg = (
         f"Failed to generate valid lesson plan after {config.max_retries} attempts"
@@ -169,11 +219,112 @@ def generate_lesson_plan(
     raise ValueError(error_msg) from last_error
 
 
+async def generate_lesson_plans(
+    prompts: list[str], config: Optional[LessonPlanConfig] = None
+) -> list[Dict[str, Any]]:
+    """Generate lesson plans for several prompts concurrently"""
+    return list(
+        await asyncio.gather(
+            *(generate_lesson_plan(prompt, config) for prompt in prompts)
+        )
+    )
+
+
+# Batching: prompts arriving within OLLAMA_BATCH_TIMEOUT seconds are collected
+# (up to OLLAMA_BATCH_SIZE) and submitted together so the Ollama server can
+# serve them as one parallel batch with shared weights. Prompts are binned by
+# length so a short prompt is never stuck behind a much longer one.
+OLLAMA_BATCH_SIZE = int(os.environ.get("OLLAMA_BATCH_SIZE", 8))
+OLLAMA_BATCH_TIMEOUT = float(os.environ.get("OLLAMA_BATCH_TIMEOUT", 0.05))
+_PROMPT_BIN_WIDTH = 512
+
+# Queue and worker task per running loop, for the same reason as _clients:
+# an asyncio.Queue is bound to the loop that created it, and under WSGI every
+# async view call gets a fresh loop.
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple]" = (
+    weakref.WeakKeyDictionary()
+)
+# Keep strong references to in-flight bin tasks so they are not collected.
+_bin_tasks: set = set()
+
+
+async def _run_bin(items: list) -> None:
+    """Run one length-bin as a single concurrent batch and resolve its futures."""
+    logger.debug(f"Submitting batch of {len(items)} prompt(s)")
+    results = await asyncio.gather(
+        *(generate_lesson_plan(prompt, config) for prompt, config, _ in items),
+        return_exceptions=True,
+    )
+    for (_, _, future), result in zip(items, results):
+        if future.cancelled():
+            continue
+        if isinstance(result, BaseException):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+
+async def _batch_worker(queue: asyncio.Queue) -> None:
+    """Drain the batch queue, binning prompts by length into concurrent batches."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + OLLAMA_BATCH_TIMEOUT
+        while len(batch) < OLLAMA_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        bins: Dict[int, list] = {}
+        for item in batch:
+            prompt, _, _ = item
+            bins.setdefault(len(prompt) // _PROMPT_BIN_WIDTH, []).append(item)
+
+        # Bins run as independent tasks so a long bin neither delays shorter
+        # ones nor stops the worker from collecting new arrivals.
+        for items in bins.values():
+            task = loop.create_task(_run_bin(items))
+            _bin_tasks.add(task)
+            task.add_done_callback(_bin_tasks.discard)
+
+
+async def generate_lesson_plan_batched(
+    prompt: str, config: Optional[LessonPlanConfig] = None
+) -> Dict[str, Any]:
+    """Queue one prompt for batched generation and await its result"""
+    loop = asyncio.get_running_loop()
+    # Started lazily because no event loop exists yet at Django app ready.
+    batcher = _batchers.get(loop)
+    if batcher is None or batcher[1].done():
+        queue = asyncio.Queue()
+        batcher = (queue, loop.create_task(_batch_worker(queue)))
+        _batchers[loop] = batcher
+    queue, _ = batcher
+    future = loop.create_future()
+    await queue.put((prompt, config, future))
+    return await future
+
+
+async def generate_lesson_plans_batched(
+    prompts: list[str], config: Optional[LessonPlanConfig] = None
+) -> list[Dict[str, Any]]:
+    """Generate lesson plans for several prompts through the batch queue"""
+    return list(
+        await asyncio.gather(
+            *(generate_lesson_plan_batched(prompt, config) for prompt in prompts)
+        )
+    )
+
+
 BASE_PROMPT = """
 You are an experienced Zambian teacher with expertise in curriculum development.
 
 Generate a lesson plan as a SINGLE VALID JSON object with exactly these fields:
-{fields}
+$fields
 
 CRITICAL INSTRUCTIONS:
 1. Return ONLY one valid JSON object, no extra text, markdown, or multiple objects.
@@ -185,10 +336,10 @@ CRITICAL INSTRUCTIONS:
 7. For "lesson_development", include step-by-step teaching activities, expected student responses, interaction methods, and assessment checkpoints as a single string.
 
 Lesson Parameters:
-{details}
+$details
 
 Example JSON structure:
-{{
+{
   "objectives": "Students will understand the process of respiration.",
   "teaching_materials": "Chalkboard, markers, respiration diagram",
   "reference_materials": "Zambian Grade 8 Science Textbook",
@@ -199,45 +350,45 @@ Example JSON structure:
   "evaluation": "Quiz on respiration components.",
   "teacher_evaluation": "Reflect on student engagement.",
   "homework": "Draw a respiration diagram."
-}}
+}
 """
 
 
-def build_prompt(lesson_data: Dict[str, Any]) -> str:
-    """Build enhanced prompt with better formatting"""
-    required_fields = [
-        "objectives",
-        "teaching_materials",
-        "reference_materials",
-        "introduction",
-        "lesson_development",
-        "conclusion",
-        "recapitulation",
-        "evaluation",
-        "teacher_evaluation",
-        "homework",
-    ]
-
-    fields = "\n".join([f"  - {field}" for field in required_fields])
-
-    details = []
-    for key, value in lesson_data.items():
-        if value:
-            details.append(f"  - {key.replace('_', ' ').title()}: {value}")
+# The fields block never changes, so substitute it into the template once at
+# import time; the per-request details are spliced in by plain concatenation,
+# with no brace scanning over the ~2KB template (and no doubled-brace escapes
+# around the JSON example).
+_REQUIRED_FIELDS = (
+    "objectives",
+    "teaching_materials",
+    "reference_materials",
+    "introduction",
+    "lesson_development",
+    "conclusion",
+    "recapitulation",
+    "evaluation",
+    "teacher_evaluation",
+    "homework",
+)
+_FIELDS_BLOCK = "\n".join(f"  - {field}" for field in _REQUIRED_FIELDS)
+_PROMPT_HEAD, _PROMPT_TAIL = BASE_PROMPT.replace("$fields", _FIELDS_BLOCK).split(
+    "$details"
+)
 
-    details_str = "\n".join(details)
 
-    return BASE_PROMPT.format(fields=fields, details=details_str)
+def build_prompt(lesson_data: Dict[str, Any]) -> str:
+    """Build enhanced prompt with better formatting"""
+    details_str = "\n".join(
+        f"  - {key.replace('_', ' ').title()}: {value}"
+        for key, value in lesson_data.items()
+        if value
+    )
+    return _PROMPT_HEAD + details_str + _PROMPT_TAIL
 
 
-def normalize_ai_response(ai_response: Dict[str, Any]) -> Dict[str, str]:
-    """Normalize AI response to match schema, flattening nested structures and mapping keys."""
-    if not isinstance(ai_response, dict):
-        logger.error(f"AI response is not a dictionary: {ai_response}")
-        raise ValueError("AI response must be a dictionary")
-
-    normalized = {}
-    key_map = {
+# AI key -> schema key, built once and frozen; read-only in normalize_ai_response.
+_KEY_MAP = MappingProxyType(
+    {
         "objective": "objectives",
         "objectives": "objectives",
         "learning_objectives": "objectives",
@@ -266,42 +417,40 @@ def normalize_ai_response(ai_response: Dict[str, Any]) -> Dict[str, str]:
         "assignment": "homework",
         "home_work": "homework",
     }
+)
+
+
+def normalize_ai_response(ai_response: Dict[str, Any]) -> Dict[str, str]:
+    """Normalize AI response to match schema, flattening nested structures and mapping keys."""
+    if not isinstance(ai_response, dict):
+        logger.error(f"AI response is not a dictionary: {ai_response}")
+        raise ValueError("AI response must be a dictionary")
+
+    normalized = {}
 
     def flatten_value(value: Any) -> str:
         """Convert nested structures or lists to a string."""
         if isinstance(value, (dict, list)):
             try:
-                # Pretty-print nested structures as a string
-                return json.dumps(value, ensure_ascii=False).replace("\n", " ").strip()
+                # orjson dumps compact UTF-8 with no newlines to clean up
+                return orjson.dumps(value).decode()
             except Exception as e:
                 logger.warning(
                     f"Failed to serialize value to JSON: {value}, error: {e}"
                 )
-                return str(value).replace("\n", " ").strip()
+        # Model text can embed literal newlines; flatten them for the schema
         return str(value).replace("\n", " ").strip()
 
     # Map AI keys to schema keys and flatten values
     for ai_key, value in ai_response.items():
-        model_key = key_map.get(ai_key.lower(), None)
+        model_key = _KEY_MAP.get(ai_key.lower())
         if model_key:
             normalized[model_key] = flatten_value(value)
         else:
             logger.warning(f"Unexpected key '{ai_key}' in AI response, ignoring")
 
     # Ensure all required fields are present
-    required_fields = [
-        "objectives",
-        "teaching_materials",
-        "reference_materials",
-        "introduction",
-        "lesson_development",
-        "conclusion",
-        "recapitulation",
-        "evaluation",
-        "teacher_evaluation",
-        "homework",
-    ]
-    for field in required_fields:
+    for field in _REQUIRED_FIELDS:
         if field not in normalized:
             normalized[field] = ""
             logger.warning(f"Missing required field '{field}', setting to empty string")
@@ -1,7 +1,50 @@
+from functools import partial
+
 from django import forms
 from .models import LessonPlan
 
 
+class LessonPlanRequestForm(forms.ModelForm):
+    """Input-only subset of the lesson plan; the AI fills the content fields."""
+
+    class Meta:
+        model = LessonPlan
+        fields = [
+            "teacher_name",
+            "date",
+            "school",
+            "time",
+            "grade",
+            "duration",
+            "subject",
+            "num_pupils",
+            "topic",
+            "sub_topic",
+            "gender",
+        ]
+        widgets = {
+            "date": forms.DateInput(attrs={"type": "date"}),
+        }
+
+    def clean_num_pupils(self):
+        num_pupils = self.cleaned_data["num_pupils"]
+        if num_pupils <= 0:
+            raise forms.ValidationError("Number of pupils must be positive")
+        return num_pupils
+
+    def _post_clean(self):
+        # Regenerating a plan for an existing slot replaces it (the view uses
+        # update_or_create), so the unique-slot constraint must not reject the
+        # form. ModelForm validates Meta.constraints inside the full_clean
+        # call it makes here, so disable constraint validation for that call.
+        full_clean = self.instance.full_clean
+        self.instance.full_clean = partial(full_clean, validate_constraints=False)
+        try:
+            super()._post_clean()
+        finally:
+            del self.instance.full_clean
+
+
 class LessonPlanForm(forms.ModelForm):
     class Meta:
         model = LessonPlan
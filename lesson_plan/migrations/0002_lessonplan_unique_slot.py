@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def dedupe_slots(apps, schema_editor):
+    """Keep only the newest plan per slot so the unique constraint can apply."""
+    LessonPlan = apps.get_model("lesson_plan", "LessonPlan")
+    seen = set()
+    for plan in LessonPlan.objects.order_by("-created_at", "-id").iterator():
+        slot = (plan.teacher_name, plan.date, plan.time, plan.subject, plan.topic)
+        if slot in seen:
+            plan.delete()
+        else:
+            seen.add(slot)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lesson_plan", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slots, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="lessonplan",
+            index=models.Index(fields=["created_at"], name="lesson_plan_created_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="lessonplan",
+            constraint=models.UniqueConstraint(
+                fields=("teacher_name", "date", "time", "subject", "topic"),
+                name="unique_lesson_plan_slot",
+            ),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 
+# The fields that identify one teaching slot; unique together below.
+SLOT_FIELDS = ("teacher_name", "date", "time", "subject", "topic")
+
 
 class LessonPlan(models.Model):
     teacher_name = models.CharField(max_length=100)
@@ -25,5 +28,19 @@ class LessonPlan(models.Model):
     homework = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One plan per teacher, slot, and topic; regenerating the same
+            # slot replaces the stored plan instead of duplicating it, and
+            # batch inserts can use ignore_conflicts.
+            models.UniqueConstraint(
+                fields=SLOT_FIELDS,
+                name="unique_lesson_plan_slot",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["created_at"], name="lesson_plan_created_idx"),
+        ]
+
     def __str__(self):
         return f"{self.sub_topic} - {self.date}"
@@ -1,19 +1,30 @@
+import functools
+import threading
+
 from django import template
 import markdown
 
 register = template.Library()
 
+# Markdown.convert is stateful and not thread-safe, so each thread reuses its
+# own instance instead of constructing a fresh parser per filter call.
+_local = threading.local()
 
-@register.filter
-def get_item(obj, key):
-    return getattr(obj, key, "")
+
+@functools.lru_cache(maxsize=1024)
+def _render_markdown(value):
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = _local.md = markdown.Markdown()
+    md.reset()
+    return md.convert(value)
 
 
 @register.filter
-def markdownify(value):
-    return markdown.markdown(value)
+def dict_get(mapping, key):
+    return mapping.get(key, "")
 
 
 @register.filter
-def attr(obj, attr_name):
-    return getattr(obj, attr_name, "")
+def markdownify(value):
+    return _render_markdown(value)
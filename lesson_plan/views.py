@@ -1,54 +1,122 @@
-from django.shortcuts import render, redirect
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.http import HttpResponse
 from django.core.exceptions import ValidationError
+from django.db import transaction
 import markdown
 
 from ai.utils import (
     build_prompt,
-    generate_lesson_plan,
-    normalize_ai_response,
-    sanitize_text,
+    generate_lesson_plan_batched,
+    sanitize_fields,
 )
-from .forms import LessonPlanForm
-from .models import LessonPlan
+from .forms import LessonPlanForm, LessonPlanRequestForm
+from .models import LessonPlan, SLOT_FIELDS
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-import io
+from reportlab.lib.styles import ParagraphStyle
+import asyncio
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-def create_lesson_plan(request):
+# ReportLab styles are request-independent; build them once at import.
+_TITLE_STYLE = ParagraphStyle(name="Title", fontSize=14, alignment=1, spaceAfter=12)
+_HEADING_STYLE = ParagraphStyle(name="Heading", fontSize=12, spaceAfter=10)
+_BODY_STYLE = ParagraphStyle(name="Body", fontSize=10, spaceAfter=8)
+_TABLE_STYLE = TableStyle(
+    [
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+        ("FONT", (0, 0), (-1, -1), "Helvetica", 10),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ]
+)
+
+_NL_RE = re.compile(r"\n")
+
+# ReportLab's doc.build is CPU-bound; run it off the event loop so long PDFs
+# don't stall other in-flight requests.
+_PDF_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pdf")
+
+# (heading, model attribute, spacer after) for the PDF body, in render order.
+_PDF_SECTIONS = (
+    ("OBJECTIVES", "objectives", True),
+    ("TEACHING MATERIAL", "teaching_materials", False),
+    ("REFERENCE MATERIALS", "reference_materials", True),
+    ("INTRODUCTION", "introduction", True),
+    ("LESSON DEVELOPMENT", "lesson_development", True),
+    ("CONCLUSION", "conclusion", False),
+    ("RECAPITULATION", "recapitulation", False),
+    ("EVALUATION", "evaluation", False),
+    ("TEACHER EVALUATION", "teacher_evaluation", True),
+    ("HOMEWORK", "homework", False),
+)
+
+async def create_lesson_plan(request):
     if request.method == "POST":
         form = LessonPlanForm(request.POST)
-        if form.is_valid():
-            lesson_plan = form.save()
-            return generate_pdf(request, lesson_plan.id)
+        if await sync_to_async(form.is_valid)():
+            lesson_plan = await sync_to_async(form.save)()
+            return await generate_pdf(request, lesson_plan.id)
     else:
         form = LessonPlanForm()
     return render(request, "lesson_plan/form.html", {"form": form})
 
 
-def generate_pdf(request, lesson_plan_id):
-    lesson_plan = LessonPlan.objects.get(id=lesson_plan_id)
+# Everything generate_pdf renders; fetching only these keeps created_at (and
+# any heavy columns added later) out of the query.
+PDF_FIELDS = (
+    "teacher_name",
+    "date",
+    "school",
+    "time",
+    "grade",
+    "duration",
+    "subject",
+    "num_pupils",
+    "topic",
+    "sub_topic",
+    "gender",
+    "objectives",
+    "teaching_materials",
+    "reference_materials",
+    "introduction",
+    "lesson_development",
+    "conclusion",
+    "recapitulation",
+    "evaluation",
+    "teacher_evaluation",
+    "homework",
+)
+
 
-    # Create a PDF response
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    styles = getSampleStyleSheet()
-    elements = []
+async def generate_pdf(request, lesson_plan_id):
+    lesson_plan = await sync_to_async(get_object_or_404)(
+        LessonPlan.objects.only(*PDF_FIELDS), id=lesson_plan_id
+    )
 
-    # Custom styles
-    title_style = ParagraphStyle(name="Title", fontSize=14, alignment=1, spaceAfter=12)
-    heading_style = ParagraphStyle(name="Heading", fontSize=12, spaceAfter=10)
-    body_style = ParagraphStyle(name="Body", fontSize=10, spaceAfter=8)
+    # Build the PDF straight into the response; no intermediate buffer copy
+    response = HttpResponse(content_type="application/pdf")
+    response["Content-Disposition"] = (
+        f'attachment; filename="lesson_plan_{lesson_plan.id}.pdf"'
+    )
+    await asyncio.get_running_loop().run_in_executor(
+        _PDF_EXECUTOR, _build_pdf, lesson_plan, response
+    )
+    return response
+
+
+def _build_pdf(lesson_plan, target):
+    doc = SimpleDocTemplate(target, pagesize=A4)
+    elements = []
 
     # Add title
     elements.append(
-        Paragraph("MINISTRY OF GENERAL EDUCATION BOARD<br/>LESSON PLAN", title_style)
+        Paragraph("MINISTRY OF GENERAL EDUCATION BOARD<br/>LESSON PLAN", _TITLE_STYLE)
     )
     elements.append(Spacer(1, 12))
 
@@ -67,157 +135,76 @@ def generate_pdf(request, lesson_plan_id):
         ["SUB-TOPIC:", lesson_plan.sub_topic, "", ""],
     ]
     table = Table(data, colWidths=[100, 200, 100, 200])
-    table.setStyle(
-        TableStyle(
-            [
-                ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-                ("FONT", (0, 0), (-1, -1), "Helvetica", 10),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ]
-        )
-    )
+    table.setStyle(_TABLE_STYLE)
     elements.append(table)
     elements.append(Spacer(1, 12))
 
-    # Add objectives
-    elements.append(Paragraph("OBJECTIVES", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.objectives.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Spacer(1, 12))
-
-    # Add teaching and reference materials
-    elements.append(Paragraph("TEACHING MATERIAL", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.teaching_materials.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Paragraph("REFERENCE MATERIALS", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.reference_materials.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Spacer(1, 12))
-
-    # Add introduction
-    elements.append(Paragraph("INTRODUCTION", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.introduction.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Spacer(1, 12))
+    # Add body sections: heading + text with newlines rendered as <br/>
+    for label, field, spacer in _PDF_SECTIONS:
+        elements.append(Paragraph(label, _HEADING_STYLE))
+        elements.append(
+            Paragraph(_NL_RE.sub("<br/>", getattr(lesson_plan, field)), _BODY_STYLE)
+        )
+        if spacer:
+            elements.append(Spacer(1, 12))
 
-    # Add lesson development
-    elements.append(Paragraph("LESSON DEVELOPMENT", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.lesson_development.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Spacer(1, 12))
+    # Build PDF
+    doc.build(elements)
 
-    # Add conclusion, recapitulation, evaluation, and teacher evaluation
-    elements.append(Paragraph("CONCLUSION", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.conclusion.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Paragraph("RECAPITULATION", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.recapitulation.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Paragraph("EVALUATION", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.evaluation.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Paragraph("TEACHER EVALUATION", heading_style))
-    elements.append(
-        Paragraph(lesson_plan.teacher_evaluation.replace("\n", "<br/>"), body_style)
-    )
-    elements.append(Spacer(1, 12))
 
-    # Add homework
-    elements.append(Paragraph("HOMEWORK", heading_style))
-    elements.append(Paragraph(lesson_plan.homework.replace("\n", "<br/>"), body_style))
+def _build_lesson_plan(sanitized_data):
+    """Build an unsaved LessonPlan from a sanitized form/AI payload."""
+    return LessonPlan(**sanitized_data)
 
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = (
-        f'attachment; filename="lesson_plan_{lesson_plan.id}.pdf"'
-    )
-    response.write(buffer.getvalue())
-    buffer.close()
-    return response
 
+def save_lesson_plans(payloads):
+    """Persist a batch of sanitized payloads with one INSERT.
 
-REQUIRED_FORM_FIELDS = [
-    "teacher_name",
-    "date",
-    "school",
-    "time",
-    "grade",
-    "duration",
-    "subject",
-    "num_pupils",
-    "topic",
-    "sub_topic",
-    "gender",
-]
+    Companion to the batched generation path: duplicate submissions for the
+    same teacher/slot/topic are dropped by the unique constraint rather than
+    failing the whole batch.
+    """
+    with transaction.atomic():
+        return LessonPlan.objects.bulk_create(
+            [_build_lesson_plan(payload) for payload in payloads],
+            batch_size=100,
+            ignore_conflicts=True,
+        )
 
 
-def generate_and_save_lesson_plan(request):
+async def generate_and_save_lesson_plan(request):
     if request.method == "POST":
         try:
-            data = request.POST.dict()
-            missing_fields = [
-                field for field in REQUIRED_FORM_FIELDS if not data.get(field)
-            ]
-
-            if missing_fields:
+            form = LessonPlanRequestForm(request.POST)
+            if not await sync_to_async(form.is_valid)():
                 raise ValidationError(
-                    f"Missing required fields: {', '.join(missing_fields)}"
+                    "; ".join(
+                        f"{field}: {', '.join(errors)}"
+                        for field, errors in form.errors.items()
+                    )
                 )
-
-            try:
-                data["num_pupils"] = int(data["num_pupils"])
-                if data["num_pupils"] <= 0:
-                    raise ValidationError("Number of pupils must be positive")
-            except (ValueError, TypeError):
-                raise ValidationError("Invalid number of pupils")
+            data = form.cleaned_data
 
             # Generate lesson plan
             logger.info(
                 f"Generating lesson plan for {data['teacher_name']} - {data['subject']}"
             )
             prompt = build_prompt(data)
-            ai_response_raw = generate_lesson_plan(prompt)
-            ai_response = normalize_ai_response(ai_response_raw)
+            # generate_lesson_plan already returns a normalized, validated dict
+            ai_response = await generate_lesson_plan_batched(prompt)
 
             # Sanitize all text inputs
-            sanitized_data = {
-                key: sanitize_text(value)
-                for key, value in {**data, **ai_response}.items()
-            }
+            sanitized_data = sanitize_fields({**data, **ai_response})
 
-            # Create and save lesson plan
-            lesson = LessonPlan.objects.create(
-                teacher_name=sanitized_data["teacher_name"],
-                date=sanitized_data["date"],
-                school=sanitized_data["school"],
-                time=sanitized_data["time"],
-                grade=sanitized_data["grade"],
-                duration=sanitized_data["duration"],
-                subject=sanitized_data["subject"],
-                num_pupils=sanitized_data["num_pupils"],
-                topic=sanitized_data["topic"],
-                sub_topic=sanitized_data["sub_topic"],
-                gender=sanitized_data["gender"],
-                objectives=sanitized_data["objectives"],
-                teaching_materials=sanitized_data["teaching_materials"],
-                reference_materials=sanitized_data["reference_materials"],
-                introduction=sanitized_data["introduction"],
-                lesson_development=sanitized_data["lesson_development"],
-                conclusion=sanitized_data["conclusion"],
-                recapitulation=sanitized_data["recapitulation"],
-                evaluation=sanitized_data["evaluation"],
-                teacher_evaluation=sanitized_data["teacher_evaluation"],
-                homework=sanitized_data["homework"],
+            # Create the plan, or replace a previous draft for the same slot;
+            # update_or_create also absorbs the unique-constraint race two
+            # concurrent submissions would otherwise hit.
+            slot = {field: sanitized_data[field] for field in SLOT_FIELDS}
+            defaults = {
+                key: value for key, value in sanitized_data.items() if key not in slot
+            }
+            lesson, _ = await sync_to_async(LessonPlan.objects.update_or_create)(
+                defaults=defaults, **slot
             )
 
             logger.info(f"Successfully created lesson plan ID {lesson.id}")
@@ -235,10 +222,19 @@ def generate_and_save_lesson_plan(request):
                 "homework",
             ]
 
+            section_values = {
+                section: getattr(lesson, section) for section in sections
+            }
+
             return render(
                 request,
                 "lesson_plan/plan_created.html",
-                {"lesson": lesson, "sections": sections, "success": True},
+                {
+                    "lesson": lesson,
+                    "sections": sections,
+                    "section_values": section_values,
+                    "success": True,
+                },
             )
 
         except ValidationError as e: